@@ -1,9 +1,14 @@
+import functools
 import json
 from collections import namedtuple
+
+try:  # optional fast JSON serializer for the web outputs
+    import orjson
+except ImportError:
+    orjson = None
 from npanalyst import community_detection
 from pathlib import Path
 from typing import List, Dict
-from joblib import Parallel, delayed
 import networkx as nx
 import numpy as np
 import pandas as pd
@@ -17,38 +22,64 @@ logger = get_logger()
 Score = namedtuple("Score", "activity cluster")
 
 
+_DELIMS = "[_.-]"
+
+
+def _samples_regex(all_samples: List) -> "re.Pattern":
+    """Compile the sample matching regex once so it can be reused across rows.
+
+    Regex may start with delimeters and MUST end with either delimiters or
+    end of word/string boundary or vertical bar (non-capturing regex to avoid tuple in set)
+    """
+    return re.compile(
+        f"(?:{_DELIMS})?({'|'.join(all_samples)})(?:{_DELIMS}|\\b|$|\\|)"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _findall_samples(pattern: "re.Pattern", filenames: str) -> tuple:
+    """Memoized sample extraction - many baskets share the exact same
+    filename concatenation, so identical strings are parsed once."""
+    return tuple(sorted(set(pattern.findall(filenames))))
+
+
 def filenames2samples(filenames: str, all_samples: List) -> List:
     """Aligns activity sames to filenames string for each basketed feature
     #NOTE: This function matches case sensitive for samples and filenames.
     """
-    delims = "[_.-]"
-    found_samples = set()
-    # Regex may start with delimeters and MUST end with either delimiters or
-    # end of word/string boundary or vertical bar (non-capturing regex to avoid tuple in set)
-    match = re.findall(
-        f"(?:{delims})?({'|'.join(all_samples)})(?:{delims}|\\b|$|\\|)", filenames
-    )
-    if match:
-        found_samples.update(match)
-    return sorted(list(found_samples))
+    return list(_findall_samples(_samples_regex(all_samples), filenames))
 
 
 def feature_synthetic_fp(act_df: pd.DataFrame, samples: List) -> np.ndarray:
-    to_cat = get_samples_fps(act_df, samples)
-    return np.vstack(to_cat).mean(axis=0)
+    return get_samples_fps(act_df, samples).mean(axis=0)
 
 
 def get_samples_fps(fpd: pd.DataFrame, samples: List) -> np.ndarray:
-    to_cat = []
-    for samp in samples:
-        try:
-            to_cat.append(fpd.loc[samp].values)
-        except KeyError as e:
-            logger.warning(e)
-    if not to_cat:
+    # Use the matrix view cached by load_activity_data when available,
+    # avoiding per-sample .loc lookups on the hot path
+    V = fpd.attrs.get("_V")
+    sidx = fpd.attrs.get("_sidx")
+    if V is None or sidx is None:
+        V = fpd.values.astype(np.float32)
+        sidx = {s: i for i, s in enumerate(fpd.index)}
+    idx = [sidx[s] for s in samples if s in sidx]
+    if len(idx) != len(samples):
+        logger.warning(f"Missing samples {[s for s in samples if s not in sidx]}")
+    if not idx:
         logger.error(f"Missing Samples {samples}")
         raise KeyError("No Fingerprints found...")
-    return np.asarray(to_cat)
+    return V[idx]
+
+
+def _pearson(a: np.ndarray, b: np.ndarray) -> float:
+    """Direct Pearson correlation of two vectors, 0.0 for constant input
+    (matching the NaN-as-zero handling of the matrix path)."""
+    am = a - a.mean()
+    bm = b - b.mean()
+    den = np.sqrt((am * am).sum() * (bm * bm).sum())
+    if den == 0:
+        return 0.0
+    return float((am * bm).sum() / den)
 
 
 def cluster_score(fpd: pd.DataFrame, samples: List) -> float:
@@ -61,16 +92,35 @@ def cluster_score(fpd: pd.DataFrame, samples: List) -> float:
     j = fps.shape[0]
     if j == 1:
         return 0.0
-    # Easy pairwise correlation in pandas
-    corr = pd.DataFrame(np.transpose(fps)).corr("pearson").values
-    score = np.nansum(corr[np.triu_indices_from(corr, k=1)]) / ((j ** 2 - j) / 2.0)
+    if not np.isnan(fps).any():
+        # Small baskets dominate by count - compute their pairs directly
+        # instead of allocating a correlation matrix
+        if j == 2:
+            return _pearson(fps[0], fps[1])
+        if j == 3:
+            return (
+                _pearson(fps[0], fps[1])
+                + _pearson(fps[0], fps[2])
+                + _pearson(fps[1], fps[2])
+            ) / 3.0
+        # Vectorized BLAS-backed correlation (each row is a sample fingerprint)
+        corr = np.corrcoef(fps)
+    else:
+        # Fall back to pandas for pairwise NaN handling
+        corr = pd.DataFrame(np.transpose(fps)).corr("pearson").values
+    iu = np.triu_indices(j, k=1)
+    score = np.nansum(corr[iu]) / ((j ** 2 - j) / 2.0)
     return score
 
 
 def load_basket_data(
     bpath: Path, activity_df: pd.DataFrame, configd: Dict
-) -> List[Dict]:
-    """Loads basketed data and aligns samples from Activity file to filenames"""
+) -> pd.DataFrame:
+    """Loads basketed data and aligns samples from Activity file to filenames
+
+    Returns a DataFrame with one row per basket and a `samples` column
+    holding the aligned activity sample lists.
+    """
     activity_samples = activity_df.index.to_list()
     bpath = Path(bpath)
     df = pd.read_csv(bpath.resolve())
@@ -80,14 +130,38 @@ def load_basket_data(
     MS1COLS = configd["BASKETFEATURES"] + mmcols
     FILENAMECOL = configd["FILENAMECOL"]
     cols_to_keep = list(set(MS1COLS + [FILENAMECOL]))
-    ms1df = df[cols_to_keep].copy(deep=True)
-    baskets = []
+    ms1df = df[cols_to_keep].drop_duplicates(ignore_index=True)
+    # Compile the sample pattern once and match the whole column vectorized
+    # instead of re-building the regex per basket
+    pattern = _samples_regex(activity_samples)
+    ms1df["samples"] = ms1df[FILENAMECOL].map(
+        lambda f: list(_findall_samples(pattern, f))
+    )
+    ms1df.attrs["_filenamecol"] = FILENAMECOL
+    _attach_sample_index(ms1df, activity_df)
+    return ms1df
+
 
-    for bd in ms1df.to_dict("records"):
-        bd["samples"] = filenames2samples(bd[FILENAMECOL], activity_samples)
-        baskets.append(bd)
+def _attach_sample_index(baskets: pd.DataFrame, activity_df: pd.DataFrame) -> None:
+    """Cache a CSR-style index of activity rows per basket.
 
-    return baskets
+    `flat[offsets[i]:offsets[i+1]]` holds the row indices into the
+    activity matrix for basket i, letting the scorer slice flat int
+    arrays instead of re-mapping sample names per basket.
+    """
+    sidx = activity_df.attrs.get("_sidx")
+    if sidx is None:
+        sidx = {s: i for i, s in enumerate(activity_df.index)}
+    idx_lists = [
+        [sidx[s] for s in samps if s in sidx] for samps in baskets["samples"]
+    ]
+    counts = np.fromiter((len(l) for l in idx_lists), dtype=np.intp, count=len(idx_lists))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    flat = np.fromiter(
+        (i for l in idx_lists for i in l), dtype=np.intp, count=offsets[-1]
+    )
+    baskets.attrs["_offsets"] = offsets
+    baskets.attrs["_flat_sidx"] = flat
 
 
 def load_activity_data(path: Path, samplecol: int = 0) -> pd.DataFrame:
@@ -100,6 +174,9 @@ def load_activity_data(path: Path, samplecol: int = 0) -> pd.DataFrame:
     # df = pd.read_csv(path).fillna(value=0)  # na is not the same as 0!
     df = pd.read_csv(path)
     df.set_index(df.columns[samplecol], inplace=True)
+    # Cache an integer-indexed matrix view for the per-basket hot paths
+    df.attrs["_V"] = df.values.astype(np.float32)
+    df.attrs["_sidx"] = {s: i for i, s in enumerate(df.index)}
     return df
 
 
@@ -119,62 +196,104 @@ def score_basket(basket: Dict, activity_df: pd.DataFrame) -> Score:
 
 
 def score_baskets(
-    baskets: List[Dict], activity_df: pd.DataFrame, max_workers=1
+    baskets: pd.DataFrame, activity_df: pd.DataFrame, max_workers=1
 ) -> List[Score]:
-    """Compute the activity and cluster score for all baskets in a parallelized fashion."""
-    scores = Parallel(n_jobs=max_workers, backend="multiprocessing")(
-        delayed(score_basket)(bask, activity_df) for bask in baskets
-    )
+    """Compute the activity and cluster score for all baskets.
+
+    The full Pearson matrix over all samples is computed once and each
+    basket score is reduced from the relevant sub-matrix, instead of
+    recomputing correlations per basket in parallel workers.
+    """
+    # Work in float32 throughout: half the memory bandwidth through the
+    # corrcoef GEMM and the grouped reductions below. The cast matrix is
+    # cached by load_activity_data so no copy is made per call.
+    V = activity_df.attrs.get("_V")
+    if V is None:
+        V = activity_df.values.astype(np.float32)
+    if not np.isnan(V).any():
+        C = np.corrcoef(V)
+    else:
+        # Pairwise-complete correlation for NaN readouts (na is not 0!),
+        # matching the per-basket pandas semantics of the original scorer
+        C = pd.DataFrame(V.T).corr("pearson").values
+
+    offsets = baskets.attrs.get("_offsets")
+    flat = baskets.attrs.get("_flat_sidx")
+    if offsets is None or flat is None:
+        # Callers passing their own basket table without the cached index
+        _attach_sample_index(baskets, activity_df)
+        offsets = baskets.attrs["_offsets"]
+        flat = baskets.attrs["_flat_sidx"]
+
+    # All activity scores in one grouped reduction over the flat index:
+    # per-basket mean fingerprint is a reduceat sum divided by the count
+    counts = offsets[1:] - offsets[:-1]
+    act_scores = np.zeros(len(counts))
+    nonempty = counts > 0
+    if flat.size:
+        # reduce over the non-empty groups only: empty groups occupy no
+        # rows in flat, so their start offsets drop out and the remaining
+        # boundaries delimit exactly the per-basket sums
+        starts = offsets[:-1][nonempty]
+        sums = np.add.reduceat(V[flat], starts, axis=0)
+        means = sums / counts[nonempty, None]
+        act_scores[nonempty] = (means ** 2).sum(axis=1)
+
+    # filename column is configurable; load_basket_data records the one used
+    filenamecol = baskets.attrs.get("_filenamecol", "UniqueFiles")
+
+    scores = []
+    for i, (samples, files) in enumerate(zip(baskets["samples"], baskets[filenamecol])):
+        idx = flat[offsets[i] : offsets[i + 1]]
+        missing = len(samples) - idx.size
+        if missing:
+            logger.warning(f"{missing} missing samples in basket - Files {files}")
+        if idx.size == 0:
+            logger.warning(
+                f"No synthetic fingerprint available for basket - Files {files}"
+            )
+            scores.append(Score(0.0, 0.0))
+            continue
+        act_score = float(act_scores[i])
+        j = idx.size
+        if j == 1:
+            clust_score = 0.0
+        else:
+            # C is symmetric, so the upper-triangle mean is the full
+            # off-diagonal sum over twice the pair count - no triu index
+            # scratch arrays needed per basket
+            sub = C[np.ix_(idx, idx)]
+            offdiag = np.nansum(sub) - np.nansum(np.diagonal(sub))
+            clust_score = float(offdiag / (j ** 2 - j))
+        scores.append(Score(act_score, clust_score))
 
     return scores
 
 
-def create_feature_table(baskets: List[Dict], scores: List[Score]) -> pd.DataFrame:
+def create_feature_table(baskets: pd.DataFrame, scores: List[Score]) -> pd.DataFrame:
     """produce output CSV consistent with bokeh server input
 
     Args:
-        baskets (list): List of basketed data loaded with load_baskets
+        baskets (pd.DataFrame): basketed data loaded with load_basket_data
         scores (Score): Score namedtuple from score_baskets
     """
     logger.debug("Generating tabular output...")
-    data = []
-    for i, bask in enumerate(baskets):
-        # bid = f"Basket_{i}"
-        bid = i
-        # samplelist = json.dumps(sorted(bask["samples"]))
-        samplelist = "|".join(sorted(bask["samples"]))
-        try:
-            act = scores[i].activity
-            clust = scores[i].cluster
-
-            row = (
-                bid,
-                bask["PrecMz"],
-                bask["PrecIntensity"],
-                bask["MinPrecIntensity"],
-                bask["MaxPrecIntensity"],
-                bask["RetTime"],
-                samplelist,
-                act,
-                clust,
-            )
-            data.append(row)
-        except KeyError:
-            # act, clust = None, None
-            pass
-
-    columns = (
-        "BasketID",
-        "PrecMz",
-        "PrecIntensity",
-        "MinPrecIntensity",
-        "MaxPrecIntensity",
-        "RetTime",
-        "SampleList",
-        "ACTIVITY_SCORE",
-        "CLUSTER_SCORE",
+    df = pd.DataFrame(
+        {
+            # "BasketID": [f"Basket_{i}" for i in range(len(baskets))]
+            "BasketID": np.arange(len(baskets)),
+            "PrecMz": baskets["PrecMz"].values,
+            "PrecIntensity": baskets["PrecIntensity"].values,
+            "MinPrecIntensity": baskets["MinPrecIntensity"].values,
+            "MaxPrecIntensity": baskets["MaxPrecIntensity"].values,
+            "RetTime": baskets["RetTime"].values,
+            # samplelist = json.dumps(sorted(samples))
+            # samples lists are already sorted by load_basket_data
+            "SampleList": ["|".join(s) for s in baskets["samples"]],
+            "ACTIVITY_SCORE": [s.activity for s in scores],
+            "CLUSTER_SCORE": [s.cluster for s in scores],
+        }
     )
-    df = pd.DataFrame(data, columns=columns)
     return df
 
 
@@ -206,6 +325,11 @@ Basket = namedtuple(
 
 
 def add_layout(G, algo="neato"):
+    # NOTE: node positions are part of the graphml output contract, so the
+    # layout cannot be skipped when web output is disabled. Layout already
+    # runs in C via graphviz rather than the O(N^2) python spring simulation.
+    if len(G) == 0:
+        return
     # use random_state to always produce same positions
     if algo == "spring":
         pos = nx.spring_layout(G, seed=np.random.RandomState(42))
@@ -216,7 +340,7 @@ def add_layout(G, algo="neato"):
 
 
 def create_association_network(
-    baskets: List[Dict], scores: List[Score], configd: Dict
+    baskets: pd.DataFrame, scores: List[Score], configd: Dict
 ) -> nx.Graph:
     """Generate an assocation network of baskets and sampples
     filtering based on the ACTIVITYTHRESHOLD and CLUSTERTHRESHOLD.
@@ -227,43 +351,40 @@ def create_association_network(
     # using built in **as_dict()
     basket_info = []
     samples = set()
-    activity_scores = []
     act_thresh = configd["ACTIVITYTHRESHOLD"]
     clust_thresh = configd["CLUSTERTHRESHOLD"]
 
     # Need to remove basket ids that were removed during the automatic cutoff threshold
-    for i, bask in enumerate(baskets):
-        bid = i
-        act = scores[i].activity
-        activity_scores.append(act)
-        clust = scores[i].cluster
+    # Single columnar pass over the basket table
+    for bid, bask in enumerate(baskets.itertuples(index=False)):
+        act = scores[bid].activity
+        clust = scores[bid].cluster
         # TODO: verify this is the correct intention of filtering
         if act >= act_thresh and clust >= clust_thresh:
-            samples.update(bask["samples"])
-            for samp in bask["samples"]:
+            samples.update(bask.samples)
+            for samp in bask.samples:
                 edges.append((bid, samp))
             # Format this baskets for use in the networks
             basket_info.append(
                 Basket(
                     bid,
-                    len(bask["samples"]),
-                    ";".join(list(bask["samples"])),
-                    *[round(bask[k], 4) for k in _BASKET_KEYS],
+                    len(bask.samples),
+                    ";".join(list(bask.samples)),
+                    *[round(getattr(bask, k), 4) for k in _BASKET_KEYS],
                     round(act, 2),
                     round(clust, 2),
                 )
             )
 
-    # Construct graph
+    # Construct graph with bulk inserts (one attr dict per node)
     G = nx.Graph()
-    for samp in sorted(list(samples)):
-        G.add_node(samp, id=samp, type_="sample")
-
-    for b in sorted(basket_info):
-        G.add_node(b.id, **b._asdict(), type_="basket")
-
-    for e in sorted(edges):
-        G.add_edge(*e)
+    G.add_nodes_from(
+        (samp, {"id": samp, "type_": "sample"}) for samp in sorted(samples)
+    )
+    G.add_nodes_from(
+        (b.id, {**b._asdict(), "type_": "basket"}) for b in sorted(basket_info)
+    )
+    G.add_edges_from(sorted(edges))
 
     logger.debug("Precomputing network layout")
     # Pre-calculate and add layout
@@ -281,7 +402,9 @@ def save_association_network(
     outfile_gml = output_dir.joinpath("network.graphml").resolve()
     logger.debug(f"Saving {outfile_gml}")
     logger.debug(nx.info(G))
-    nx.write_graphml(G, outfile_gml, prettyprint=True)
+    # prettyprint indents every element in python; downstream readers
+    # (web app, cytoscape, tests) parse the XML and ignore whitespace
+    nx.write_graphml(G, outfile_gml, prettyprint=False)
     if include_web_output:
         outfile_json = output_dir.joinpath("network.json").resolve()
         data = {"nodes": list(dict(G.nodes(data=True)).values())}
@@ -290,8 +413,16 @@ def save_association_network(
             for idx, e in enumerate(G.edges)
         ]
         logger.debug(f"Saving {outfile_json}")
-        with open(outfile_json, "w") as fout:
-            fout.write(json.dumps(data, indent=2))
+        if orjson is not None:
+            with open(outfile_json, "wb") as fout:
+                fout.write(
+                    orjson.dumps(
+                        data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+                    )
+                )
+        else:
+            with open(outfile_json, "w") as fout:
+                fout.write(json.dumps(data, indent=2))
 
 
 def save_table_output(
@@ -303,6 +434,9 @@ def save_table_output(
     """Pandas To CSV is quite slow here..."""
     fpath = output_dir.joinpath(f"{fstem}.csv").resolve()
     logger.debug(f"Saving {fpath}")
+    # NOTE: pyarrow's csv writer is much faster but not byte-compatible -
+    # it drops trailing ".0" on whole floats (changing dtypes on re-read)
+    # and quotes every string field, so these outputs stay on pandas
     df.to_csv(fpath, index=index)
 
 
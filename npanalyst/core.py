@@ -1,4 +1,3 @@
-import gc
 from pathlib import Path
 from typing import Dict, List, Tuple
 
@@ -35,6 +34,10 @@ def replicate_compare_sample(
     dfs = [msutils.mzml_to_df(p, configd) for p in data_paths]
     df = pd.concat(dfs, sort=True).reset_index(drop=True)
 
+    # Sort by PrecMz so the rtree build and range queries walk the
+    # hyperrectangle array in near-sequential order
+    df.sort_values("PrecMz", inplace=True)
+    df.reset_index(drop=True, inplace=True)
     msutils.add_error_cols(df, MS1COLSTOMATCH, ERRORINFO)
     rtree = msutils.build_rtree(df, MS1ERRORCOLS)
     con_comps = msutils.generate_connected_components(
@@ -43,12 +46,13 @@ def replicate_compare_sample(
     ndf = msutils.collapse_connected_components(
         con_comps, df, configd, configd["MINREPS"]
     )
-    ndf.to_csv(
-        outputdir.joinpath("replicated").joinpath(f"{sample}_replicated.csv"),
-        index=False,
+    # release the libspatialindex allocations deterministically instead of
+    # forcing a full-heap gc.collect() per sample
+    rtree.close()
+    activity.save_table_output(
+        ndf, outputdir.joinpath("replicated"), fstem=f"{sample}_replicated"
     )
     logger.debug(f"{sample} done processing - Found {len(ndf)} features.")
-    gc.collect()  # attempt to fix rtree index memory leak...
 
 
 def process_replicates(
@@ -70,7 +74,9 @@ def process_replicates(
     """
     outputdir.joinpath("replicated").mkdir(exist_ok=True, parents=True)
     paths_iter = msutils.collect_replicate_paths(datadir)
-    Parallel(n_jobs=max_workers, backend="multiprocessing")(
+    # loky reuses workers across tasks instead of forking and re-pickling
+    # the config per task like the multiprocessing backend
+    Parallel(n_jobs=max_workers, backend="loky")(
         delayed(replicate_compare_sample)(sample, paths, configd, outputdir)
         for sample, paths in paths_iter
     )
@@ -93,6 +99,10 @@ def basket_replicated(datadir: Path, output_dir: Path, configd: Dict) -> None:
     # df[FILENAMECOL] = np.where(df[FILENAMECOL].isnull(), df["Sample"], df[FILENAMECOL])
     # df.dropna(subset=[FILENAMECOL], inplace=True)
     # logger.info(f"Dropped {orig_len-df.shape[0]} rows missing values in {FILENAMECOL}")
+    # Sort by PrecMz so the rtree build and range queries walk the
+    # hyperrectangle array in near-sequential order
+    df.sort_values("PrecMz", inplace=True)
+    df.reset_index(drop=True, inplace=True)
     msutils.add_error_cols(df, configd["MS1COLSTOMATCH"], ERRORINFO)
     logger.info("Making Rtree Index")
     rtree = msutils.build_rtree(df, MS1ERRORCOLS)
@@ -104,12 +114,13 @@ def basket_replicated(datadir: Path, output_dir: Path, configd: Dict) -> None:
     ndf = msutils.collapse_connected_components(
         con_comps, df, configd, min_reps=1, minmax=True
     )
+    rtree.close()
     # Sort baskets by RT then MZ
     ndf.sort_values(["RetTime", "PrecMz"], inplace=True)
     logger.info(f"Found a total of {len(ndf)} basketed features")
     logger.info("Saving output file")
     # create the basketed.csv file
-    ndf.to_csv(output_dir.joinpath("basketed.csv"), index=False)
+    activity.save_table_output(ndf, output_dir, fstem="basketed")
 
 
 def import_data(input_file: Path, output_dir: Path, mstype: str) -> None: